@@ -1,29 +1,80 @@
+import os
 import re
-import requests
-from requests.exceptions import SSLError
+import mmap
+import shutil
+import subprocess
+import multiprocessing
+import asyncio
+import aiohttp
 from urllib.parse import urlparse
-from bs4 import BeautifulSoup
+from utils.page_text import parse_html, visible_text_nodes
 from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Maximum number of pages fetched concurrently by the async drivers
+FETCH_CONCURRENCY = 32
+FETCH_TIMEOUT = 20
+# Bytes of each page read when finding the longest page, to bound memory per in-flight download. Pages
+# larger than this are ranked on a truncated count (and reported as such), so if several exceed it the
+# truly longest one may not win.
+MAX_PAGE_BYTES = 2 * 1024 * 1024
+_READ_CHUNK_BYTES = 64 * 1024
+
+# Extensions of downloaded files that are not worth fetching for word statistics
+_SKIP_SUFFIXES = ('.mpg', '.mp4', '.avi', '.mov', '.mkv', '.ogg', '.ogv', '.pdf', '.png', '.jpg', '.jpeg',
+                  '.gif', '.bmp', '.wav', '.mp3', '.zip', '.rar', '.gz', '.exe', '.dmg', '.iso')
+
+def _page_key(url):
+    """Return a downloaded URL (as bytes) without its fragment or an empty trailing query, like urlparse(...).geturl() would."""
+    url = url.split(b'#', 1)[0]
+    if url.endswith(b'?') and url.index(b'?') == len(url) - 1:
+        url = url[:-1]
+    return url
+
+def _find_downloaded_pages(log_file_path):
+    """Return the set of unique downloaded pages (see _page_key) in a Worker.log file."""
+    url_pattern = re.compile(rb'Downloaded (https?://[^\s,]+)')
+
+    # Scan the whole log as one buffer so the regex engine does the work instead of a per-line Python loop,
+    # deduplicating as matches are found so memory is bounded by unique pages rather than downloads
+    with open(log_file_path, 'rb') as log_file:
+        if os.fstat(log_file.fileno()).st_size == 0:
+            return set()
+        with mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ) as log_buffer:
+            return {_page_key(match.group(1)) for match in url_pattern.finditer(log_buffer)}
+
+def _find_downloaded_pages_rg(log_file_path):
+    """Return the set of unique downloaded pages in a Worker.log file using ripgrep, or None if ripgrep is unavailable or fails."""
+    rg_path = shutil.which('rg')
+    if rg_path is None:
+        return None
+
+    with subprocess.Popen(
+            # --no-config ignores the user's ripgrep config, --text keeps matching past stray NUL bytes and
+            # --no-unicode makes \s ASCII-only, matching the bytes pattern in _find_downloaded_pages
+            [rg_path, '--no-config', '--text', '--no-unicode',
+             '--only-matching', '--no-line-number', '--no-filename', '--replace', '$1',
+             r'Downloaded (https?://[^\s,]+)', log_file_path],
+            stdout=subprocess.PIPE) as proc:
+        # Deduplicate while reading so memory is bounded by unique pages rather than downloads
+        unique_urls = {_page_key(line.rstrip(b'\n')) for line in proc.stdout}
+
+    # ripgrep exits with 1 when nothing matched and 2 on errors
+    if proc.returncode not in (0, 1):
+        return None
+    return unique_urls
 
 def count_unique_pages(log_file_path):
     """Counts the number of unique pages from a Worker.log file, based on URL uniqueness (ignoring fragments)."""
-    unique_urls = set()
-    url_pattern = re.compile(r'Downloaded (https?://[^\s,]+)')
-
-    with open(log_file_path, 'r') as log_file:
-        for line in log_file:
-            match = url_pattern.search(line)
-            if match:
-                url = match.group(1)
-                # Parse URL and remove fragment
-                parsed_url = urlparse(url)
-                defragmented_url = parsed_url._replace(fragment="").geturl()
-                unique_urls.add(defragmented_url)
+    # Prefer ripgrep for very large logs, falling back to scanning the file in Python
+    unique_urls = _find_downloaded_pages_rg(log_file_path)
+    if unique_urls is None:
+        unique_urls = _find_downloaded_pages(log_file_path)
 
     return len(unique_urls)
 
 # List of English stop words (loaded from the ranks.nl website)
-STOP_WORDS = set([
+STOP_WORDS = frozenset([
     "a", "about", "above", "after", "again", "against", "all", "am", "an", "and", "any", "are", "aren't", "as", "at",
     "be", "because", "been", "before", "being", "below", "between", "both", "but", "by", "can't", "cannot", "could",
     "couldn't", "did", "didn't", "do", "does", "doesn't", "doing", "don't", "down", "during", "each", "few", "for",
@@ -40,97 +91,146 @@ STOP_WORDS = set([
     "yourselves"
 ])
 
+# Unicode-aware word tokens; symbols such as '©', '–' and curly quotes are never part of a word
+_WORD_RE = re.compile(r'\b\w+\b')
+
 def extract_urls_with_status_200(log_file_path):
-    """Extract URLs with status 200 from the Worker.log file, filtering out non-text files and specific problematic URLs."""
-    urls = []
+    """Yield URLs with status 200 from the Worker.log file, filtering out non-text files and specific problematic URLs."""
+    url_pattern = re.compile(r'Downloaded (\S+), status <200>')
     with open(log_file_path, 'r') as file:
         for line in file:
-            match = re.search(r'Downloaded (\S+), status <200>', line)
+            start = line.find('Downloaded ')
+            if start == -1:
+                continue
+            match = url_pattern.match(line, start)
             if match:
                 url = match.group(1)
 
                 # Skip non-text files based on their extensions
-                if not re.search(r'\.(mpg|mp4|avi|mov|mkv|ogg|ogv|pdf|png|jpg|jpeg|gif|bmp|wav|mp3|zip|rar|gz|exe|dmg|iso)$', url.lower()):
-                    urls.append(url)
+                url_lc = url.lower()
+                if not url_lc.endswith(_SKIP_SUFFIXES):
+                    yield url
                 else:
                     print(f"Skipping non-text file: {url}")
-    return urls
 
-def count_words_in_url(url):
-    """Download content of a URL and count the number of words (excluding HTML markup)."""
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
+def count_words_in_content(content, encoding=None):
+    """Count the number of words in an HTML document (excluding HTML markup, scripts and styles)."""
+    tree = parse_html(content, encoding)
+    if tree is None:
+        return 0
 
-        # Parse HTML and extract text
-        soup = BeautifulSoup(response.content, 'html.parser')
-        text = soup.get_text(separator=' ', strip=True)
+    # Count words node by node instead of joining the whole page into one string
+    return sum(len(text.split()) for text in visible_text_nodes(tree))
 
-        # Count words in text
-        words = text.split()
-        return len(words)
-    except SSLError:
+async def fetch(session, url, max_bytes=None):
+    """
+    Download the body of a URL (at most max_bytes of it, if given), returning (body, charset, truncated) where
+    charset comes from the Content-Type header and truncated says whether the body was cut at max_bytes,
+    or None if the request fails.
+    """
+    try:
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=FETCH_TIMEOUT)) as resp:
+            resp.raise_for_status()
+            if max_bytes is None:
+                return await resp.read(), resp.charset, False
+            # Read one byte past the cap so a body of exactly max_bytes is not reported as truncated
+            body = bytearray()
+            async for chunk in resp.content.iter_chunked(_READ_CHUNK_BYTES):
+                body += chunk
+                if len(body) > max_bytes:
+                    break
+            return bytes(body[:max_bytes]), resp.charset, len(body) > max_bytes
+    except aiohttp.ClientSSLError:
         print(f"SSL error for {url}. Skipping.")
-        return 0
-    except requests.RequestException as e:
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         print(f"Failed to download {url}: {e}")
-        return 0
+    return None
+
+async def fetch_and_parse_all(urls, parse, default, executor, on_result, max_bytes=None):
+    """Fetch URLs concurrently as they are produced, apply parse(body, charset) to each page on executor and pass each (index, url, result, truncated) to on_result as it completes, index being the URL's position in urls."""
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=2 * FETCH_CONCURRENCY)
+
+    async def produce():
+        # Feed URLs as the iterable yields them so fetching overlaps with reading the log
+        for item in enumerate(urls):
+            await queue.put(item)
+        for _ in range(FETCH_CONCURRENCY):
+            await queue.put(None)
+
+    async def consume(session):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            index, url = item
+            page = await fetch(session, url, max_bytes)
+            if page is None:
+                on_result(index, url, default, False)
+            else:
+                # Parsing runs on the executor so it does not stall the event loop
+                content, charset, truncated = page
+                on_result(index, url, await loop.run_in_executor(executor, parse, content, charset), truncated)
+
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(produce(), *[consume(session) for _ in range(FETCH_CONCURRENCY)])
 
 def find_longest_page(log_file_path):
     """Find the URL with the longest page in terms of word count."""
     urls = extract_urls_with_status_200(log_file_path)
     longest_url = None
+    longest_index = None
     max_word_count = 0
 
-    for url in urls:
-        word_count = count_words_in_url(url)
-        print(f"{url}: {word_count} words")
+    def record(index, url, word_count, truncated):
+        nonlocal longest_url, longest_index, max_word_count
+        if truncated:
+            print(f"{url}: {word_count} words (only the first {MAX_PAGE_BYTES} bytes were counted)")
+        else:
+            print(f"{url}: {word_count} words")
         
-        if word_count > max_word_count:
+        # Pages finish in any order, so break ties on log position to keep the result deterministic
+        if word_count > max_word_count or (
+                longest_url is not None and word_count == max_word_count and index < longest_index):
             max_word_count = word_count
             longest_url = url
+            longest_index = index
+
+    # Counting is mostly lxml parsing, which releases the GIL, so threads are enough here
+    with ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY) as executor:
+        asyncio.run(fetch_and_parse_all(urls, count_words_in_content, 0, executor, record, MAX_PAGE_BYTES))
 
     print(f"The longest page is {longest_url} with {max_word_count} words.")
     return longest_url
 
-def get_words_from_url(url):
-    """Download content of a URL, extract words, and filter out stop words."""
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-
-        # Parse HTML and extract text
-        soup = BeautifulSoup(response.content, 'html.parser')
-        text = soup.get_text(separator=' ', strip=True)
+def get_words_from_content(content, encoding=None):
+    """Count the words in an HTML document (excluding HTML markup, scripts, styles and stop words)."""
+    tree = parse_html(content, encoding)
+    if tree is None:
+        return Counter()
 
-        # Split text into words and filter out stop words
-        words = re.findall(r'\b\w+\b', text.lower())  # Convert to lowercase and extract words
-        return [word for word in words if word not in STOP_WORDS]
-    except SSLError:
-        print(f"SSL error for {url}. Skipping.")
-        return []
-    except requests.RequestException as e:
-        print(f"Failed to download {url}: {e}")
-        return []
+    # Stream words out of each lowercased text node and filter out stop words without building a token list
+    words = (match.group(0) for text in visible_text_nodes(tree) for match in _WORD_RE.finditer(text.lower()))
+    return Counter(word for word in words if word not in STOP_WORDS)
 
 def find_most_common_words(log_file_path, top_n=50):
     """Find the most common words across all pages, excluding stop words."""
     urls = extract_urls_with_status_200(log_file_path)
     word_counter = Counter()
 
-    for url in urls:
-        words = get_words_from_url(url)
-        word_counter.update(words)
-
-        # Print intermediate results for top N most common words so far
-        most_common_words = word_counter.most_common(top_n)
-        print(f"Current top {top_n} most common words after processing {url}:")
-        for word, count in most_common_words:
-            print(f"{word}: {count}")
-        print("\n" + "-"*50 + "\n")
-
-    # Final top 50 most common words
-    print("Final top 50 most common words across all pages:")
+    def merge(index, url, page_counter, truncated):
+        # Fold each page in as soon as it is counted so per-page Counters are not kept around
+        word_counter.update(page_counter)
+
+    # Tokenizing and stop-word filtering is pure Python, so each page is counted in a separate process
+    # and only its Counter is sent back. Workers start while aiohttp's threads are running, so they are
+    # spawned rather than forked from this process ('spawn' is also the only start method on Windows).
+    with ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=multiprocessing.get_context('spawn')) as executor:
+        asyncio.run(fetch_and_parse_all(urls, get_words_from_content, Counter(), executor, merge))
+
+    # Rank only once every page has been counted
+    most_common_words = word_counter.most_common(top_n)
+    print(f"Final top {top_n} most common words across all pages:")
     for word, count in most_common_words:
         print(f"{word}: {count}")
 
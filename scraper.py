@@ -1,8 +1,71 @@
 import re
+from functools import lru_cache
 from urllib.parse import urlparse, urlunparse, urljoin
-from bs4 import BeautifulSoup
+from lxml import etree
+from utils.page_text import parse_html, visible_text_nodes
 from simhash import Simhash  
 
+# Only URLs on these subdomains of uci.edu are crawled
+_ALLOWED_DOMAINS = (
+    ".ics.uci.edu",
+    ".cs.uci.edu",
+    ".informatics.uci.edu",
+    ".stat.uci.edu",
+    "today.uci.edu"
+)
+
+# File extensions that are not worth crawling
+_BAD_EXTS = frozenset({
+    "css", "js", "bmp", "gif", "jpg", "jpeg", "ico",
+    "png", "tif", "tiff", "mid", "mp2", "mp3", "mp4",
+    "wav", "avi", "mov", "mpeg", "ram", "m4v", "mkv", "ogg", "ogv", "pdf",
+    "ps", "eps", "tex", "ppt", "pptx", "doc", "docx", "xls", "xlsx", "names",
+    "data", "dat", "exe", "bz2", "tar", "msi", "bin", "7z", "psd", "dmg", "iso",
+    "epub", "dll", "cnf", "tgz", "sha1",
+    "thmx", "mso", "arff", "rtf", "jar", "csv",
+    "rm", "smil", "wmv", "swf", "wma", "zip", "rar", "gz"
+})
+
+# Query parameters that indicate calendars, pagination and other crawler traps
+_TRAP_RE = re.compile(r"(calendar|wp-content|replytocom|php\?id=|sort=|session=|ref=|page=|start=|dir=|date=|filter=|id=|sid=|query=|view=|tag=|highlight=|theme=)")
+
+# Near-duplicate detection: 64-bit simhashes within this Hamming distance are treated as the same page.
+# Each hash is split into one more band than the allowed distance, so by pigeonhole a near duplicate
+# must share at least one band exactly and only hashes indexed under a matching band need comparing.
+_SIMHASH_MAX_DISTANCE = 3
+_SIMHASH_BANDS = 4
+_SIMHASH_BAND_BITS = 16
+_SIMHASH_BAND_MASK = (1 << _SIMHASH_BAND_BITS) - 1
+
+def _simhash_band_keys(simhash_value):
+    """Splits a 64-bit simhash into its 16-bit band values."""
+    return [(simhash_value >> (band * _SIMHASH_BAND_BITS)) & _SIMHASH_BAND_MASK for band in range(_SIMHASH_BANDS)]
+
+# int.bit_count() (Python 3.10+) is a native popcount; older interpreters count the 1s in the binary string
+if hasattr(int, "bit_count"):
+    def _hamming_distance(first_hash, second_hash):
+        """Returns the number of differing bits between two simhashes."""
+        return (first_hash ^ second_hash).bit_count()
+else:
+    def _hamming_distance(first_hash, second_hash):
+        """Returns the number of differing bits between two simhashes."""
+        return bin(first_hash ^ second_hash).count('1')
+
+# Anchor targets, compiled once
+_HREF_XPATH = etree.XPath("//a/@href", smart_strings=False)
+
+def _declared_charset(raw_response):
+    """
+    Returns the charset named in the response's Content-Type header, or None if there is none.
+    raw_response.encoding is not used because it defaults to ISO-8859-1 for any text/* response.
+    """
+    content_type = raw_response.headers.get("Content-Type", "")
+    for param in content_type.split(";")[1:]:
+        key, _, value = param.partition("=")
+        if key.strip().lower() == "charset":
+            return value.strip().strip("'\"") or None
+    return None
+
 def scraper(url, resp):
     """
     Calls extract_next_links to obtain valid URLs, avoiding duplicates.
@@ -28,40 +91,50 @@ def extract_next_links(url, resp):
     Returns:
     list of str: List of hyperlinks found on the page, deduplicated by content similarity.
     """
-    # Initialize visited_simhashes as an attribute of the function
-    if not hasattr(extract_next_links, "visited_simhashes"):
-        extract_next_links.visited_simhashes = set()
+    # Initialize the simhash band index as an attribute of the function (one band value -> hashes table per band)
+    if not hasattr(extract_next_links, "simhash_bands"):
+        extract_next_links.simhash_bands = [{} for _ in range(_SIMHASH_BANDS)]
 
     links = []
 
     # Check if there is content in the response
     if resp.raw_response and resp.raw_response.content:
-        soup = BeautifulSoup(resp.raw_response.content, 'html.parser')
+        tree = parse_html(resp.raw_response.content, _declared_charset(resp.raw_response))
+        if tree is None:
+            # Empty or non-HTML body
+            return links
 
         # Ignoring scripts and styles
-        for script_or_style in soup(['script', 'style']):
-            script_or_style.decompose()
-        content_text = soup.get_text(separator=' ', strip=True)
+        content_text = ' '.join(text.strip() for text in visible_text_nodes(tree) if text.strip())
 
         # Generate Simhash for the page content
         content_simhash = Simhash(content_text).value
 
-        # Check for duplicates using Simhash similarity
-        if any(bin(content_simhash ^ existing_hash).count('1') <= 3 for existing_hash in extract_next_links.visited_simhashes):
+        # Check for duplicates using Simhash similarity, only against hashes sharing a band
+        band_keys = _simhash_band_keys(content_simhash)
+        candidates = set()
+        for band_table, band_key in zip(extract_next_links.simhash_bands, band_keys):
+            candidates.update(band_table.get(band_key, ()))
+        if any(_hamming_distance(content_simhash, existing_hash) <= _SIMHASH_MAX_DISTANCE for existing_hash in candidates):
             return [] 
-        extract_next_links.visited_simhashes.add(content_simhash)  # Add new Simhash if unique
 
-        # Extract all anchor tags and their href attributes
-        for anchor in soup.find_all('a', href=True):
+        # Add new Simhash to every band table if unique
+        for band_table, band_key in zip(extract_next_links.simhash_bands, band_keys):
+            band_table.setdefault(band_key, set()).add(content_simhash)
+
+        # Extract the href attribute of all anchor tags
+        for href in _HREF_XPATH(tree):
             # Use urljoin to form absolute URLs from relative paths
-            link = urljoin(url, anchor['href'])
+            link = urljoin(url, href)
             links.append(link)
 
     return links
 
+@lru_cache(maxsize=65536)
 def is_valid(url):
     """
     Decides whether to crawl this URL or not. Returns True if the URL is within specified domains and paths.
+    Results are memoized since the same links are seen on many pages.
 
     Parameters:
     url (str): The URL to check.
@@ -70,7 +143,7 @@ def is_valid(url):
     bool: True if the URL is valid for crawling; False otherwise.
     """
     try:
-        # Parse the URL
+        # Checks run cheapest first; most links on external pages fail the domain check
         parsed = urlparse(url)
         
         # Immediately return False if there is a fragment
@@ -81,27 +154,17 @@ def is_valid(url):
         if parsed.scheme not in {"http", "https"}:
             return False
 
-        # File extension check: Skip non-crawlable file types
-        if re.match(
-            r".*\.(css|js|bmp|gif|jpe?g|ico"
-            + r"|png|tiff?|mid|mp2|mp3|mp4"
-            + r"|wav|avi|mov|mpeg|ram|m4v|mkv|ogg|ogv|pdf"
-            + r"|ps|eps|tex|ppt|pptx|doc|docx|xls|xlsx|names"
-            + r"|data|dat|exe|bz2|tar|msi|bin|7z|psd|dmg|iso"
-            + r"|epub|dll|cnf|tgz|sha1"
-            + r"|thmx|mso|arff|rtf|jar|csv"
-            + r"|rm|smil|wmv|swf|wma|zip|rar|gz)$", parsed.path.lower()):
+        # Only allow URLs from the specified subdomains of uci.edu
+        if not parsed.netloc.endswith(_ALLOWED_DOMAINS):
             return False
 
-        # Only allow URLs from the specified subdomains of uci.edu
-        allowed_domains = {
-            ".ics.uci.edu",
-            ".cs.uci.edu",
-            ".informatics.uci.edu",
-            ".stat.uci.edu",
-            "today.uci.edu"
-        }
-        if not any(parsed.netloc.endswith(domain) for domain in allowed_domains):
+        # Lowercase the parts that are matched case-insensitively
+        path_lc = parsed.path.lower()
+        query_lc = parsed.query.lower()
+
+        # File extension check: Skip non-crawlable file types
+        ext_index = path_lc.rfind('.')
+        if ext_index != -1 and path_lc[ext_index + 1:] in _BAD_EXTS:
             return False
 
         # Path restriction for today.uci.edu
@@ -109,11 +172,11 @@ def is_valid(url):
             return False
 
         # Trap detection: avoid calendar and paginated URLs
-        if re.search(r"(calendar|wp-content|replytocom|php\?id=|sort=|session=|ref=|page=|start=|dir=|date=|filter=|id=|sid=|query=|view=|tag=|highlight=|theme=)", parsed.query.lower()):
+        if _TRAP_RE.search(query_lc):
             return False
         
         # Avoid deeply nested paths or excessively long query strings
-        if parsed.path.count('/') > 4 or len(parsed.query) > 50:
+        if path_lc.count('/') > 4 or len(query_lc) > 50:
             return False
 
         return True
@@ -0,0 +1,39 @@
+import lxml.html
+from bs4 import UnicodeDammit
+from lxml import etree
+
+# Visible page text: every text node except script and style bodies. Shared by the
+# scraper's simhash dedup and the word statistics in results.py.
+_TEXT_XPATH = etree.XPath("//text()[not(ancestor::script)][not(ancestor::style)]", smart_strings=False)
+
+
+def decode_html(content, encoding=None):
+    ''' Decodes an HTML body with the charset from the HTTP headers if there is one, otherwise
+        detecting it from the document the way BeautifulSoup does. '''
+    if encoding:
+        try:
+            return content.decode(encoding, errors="replace")
+        except LookupError:
+            pass
+    return UnicodeDammit(content, is_html=True).unicode_markup
+
+
+def parse_html(content, encoding=None):
+    ''' Parses an HTML body into an lxml tree, or returns None if it is empty or not HTML. '''
+    if not content or not content.strip():
+        return None
+    text = decode_html(content, encoding)
+    if not text:
+        return None
+    try:
+        # libxml2 would otherwise guess the charset itself (falling back to Latin-1), so hand it
+        # UTF-8 bytes and say so. A parser is built per call because lxml parsers must not be
+        # shared between threads.
+        return lxml.html.fromstring(text.encode("utf-8"), parser=lxml.html.HTMLParser(encoding="utf-8"))
+    except (etree.ParserError, ValueError):
+        return None
+
+
+def visible_text_nodes(tree):
+    ''' Returns the text nodes of a parsed page that a reader would see. '''
+    return _TEXT_XPATH(tree)